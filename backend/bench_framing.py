@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Throughput of OutputFramer against the relay it sits on. The relay baseline is
+# what reader() in main.py does per chunk: data arrives on a pipe (stand-in for
+# the pty), then select + read, the debug preview print, and a websocket send
+# over localhost to a client that drains it, all on one asyncio loop.
+# Usage: python backend/bench_framing.py [--mb 64]
+import argparse
+import asyncio
+import os
+import random
+import select
+import sys
+import time
+
+import websockets
+
+from framing import OutputFramer
+
+CHUNK = 4096
+PIECES = [
+    "plain ascii output line with some words ", "wörld ", "日本語テキスト ", "😀 ",
+    "\x1b[38;5;111m", "\x1b[0m", "\x1b[1;31m", "\x1b[2K\x1b[1G", "\x1b]0;title ✓\x07",
+    "\x1b]8;;https://example.com\x1b\\", "\r\n",
+]
+
+
+def sample_output(size: int) -> bytes:
+    rnd = random.Random(0)
+    parts = []
+    total = 0
+    while total < size:
+        p = rnd.choice(PIECES).encode("utf-8")
+        parts.append(p)
+        total += len(p)
+    return b"".join(parts)
+
+
+def bench_framer(chunks: list[bytes]) -> float:
+    framer = OutputFramer()
+    start = time.perf_counter()
+    for chunk in chunks:
+        framer.feed(chunk)
+    framer.flush()
+    return time.perf_counter() - start
+
+
+async def relay(chunks: list[bytes]) -> float:
+    total = sum(len(c) for c in chunks)
+    done = asyncio.get_running_loop().create_future()
+    elapsed = 0.0
+
+    async def pump(ws):
+        nonlocal elapsed
+        r, w = os.pipe()
+        try:
+            with open(os.devnull, "w") as log:
+                start = time.perf_counter()
+                for chunk in chunks:
+                    os.write(w, chunk)
+                    await asyncio.sleep(0)
+                    select.select([r], [], [], 0.05)
+                    data = os.read(r, CHUNK)
+                    preview = data.decode("utf-8", errors="ignore")[:120]
+                    print(f"[pty→ws] {len(data)} bytes: {preview!r}", file=log)
+                    await ws.send(data)
+                await done
+                elapsed = time.perf_counter() - start
+        finally:
+            os.close(r)
+            os.close(w)
+
+    async with websockets.serve(pump, "127.0.0.1", 0, compression=None) as server:
+        port = server.sockets[0].getsockname()[1]
+        async with websockets.connect(f"ws://127.0.0.1:{port}", max_size=None, compression=None) as ws:
+            received = 0
+            async for msg in ws:
+                received += len(msg)
+                if received >= total:
+                    done.set_result(None)
+                    break
+            await ws.close()
+    return elapsed
+
+
+def bench_relay(chunks: list[bytes]) -> float:
+    return asyncio.run(relay(chunks))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark output framing cost")
+    ap.add_argument("--mb", type=int, default=64, help="megabytes of synthetic terminal output")
+    args = ap.parse_args()
+    data = sample_output(args.mb << 20)
+    chunks = [data[i:i + CHUNK] for i in range(0, len(data), CHUNK)]
+    mb = len(data) / (1 << 20)
+    framer = min(bench_framer(chunks) for _ in range(3))
+    relay = min(bench_relay(chunks) for _ in range(3))
+    per_chunk = 1e9 / len(chunks)
+    print(f"chunks: {len(chunks)} x {CHUNK} bytes ({mb:.0f} MiB)")
+    print(f"framer: {mb / framer:8.0f} MiB/s  {framer * per_chunk:8.0f} ns/chunk")
+    print(f"relay:  {mb / relay:8.0f} MiB/s  {relay * per_chunk:8.0f} ns/chunk")
+    print(f"framer / relay: {framer / relay:.1%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+# Output framing for the pty -> websocket path.
+# pty reads return arbitrary slices; OutputFramer holds back a trailing partial
+# UTF-8 character or ANSI escape sequence so every frame ends on a boundary and
+# downstream consumers (browser TextDecoder, recording, compression) never
+# need to re-buffer.
+
+import re
+
+# String sequences (OSC ], DCS P, SOS X, PM ^, APC _) run until ST, or BEL for OSC
+STRING_INTRODUCERS = frozenset(b"]PX^_")
+# Bytes that may follow "ESC [" (CSI) or "ESC" (nF) without finishing the sequence
+_CSI_PENDING = re.compile(rb"[\x20-\x3f]*")
+_NF_PENDING = re.compile(rb"[\x20-\x2f]*")
+# Longest unterminated sequence we hold back before giving up and flushing it
+MAX_HOLD = 4096
+
+
+def _utf8_boundary(buf: bytes, end: int) -> int:
+    # Same rule an incremental UTF-8 decoder applies, but only to the last
+    # <=3 bytes instead of decoding the whole frame.
+    i = end - 1
+    lo = max(end - 4, -1)
+    while i > lo and 0x80 <= buf[i] <= 0xBF:
+        i -= 1
+    if i <= lo:
+        return end  # no lead byte in reach: invalid, pass through
+    lead = buf[i]
+    if lead < 0xC0:
+        return end
+    need = 2 if lead < 0xE0 else 3 if lead < 0xF0 else 4 if lead < 0xF8 else 1
+    return i if end - i < need else end
+
+
+def frame_boundary(buf: bytes) -> int:
+    """Length of the prefix of buf that ends on a character and sequence boundary.
+
+    Only ST may appear inside a string sequence, so looking at the last ESC
+    (and, for a lone trailing ESC, the one before it) is enough to tell
+    whether the tail is an unterminated sequence.
+    """
+    n = len(buf)
+    cut = n
+    lo = n - MAX_HOLD if n > MAX_HOLD else 0
+    esc = buf.rfind(b"\x1b", lo)
+    if esc >= 0:
+        nxt = buf[esc + 1] if esc + 1 < n else -1
+        if nxt in STRING_INTRODUCERS:
+            if not (nxt == 0x5D and buf.find(b"\x07", esc + 2) >= 0):
+                cut = esc
+        elif nxt == 0x5B:
+            if _CSI_PENDING.match(buf, esc + 2).end() == n:
+                cut = esc
+        elif 0x20 <= nxt <= 0x2F:
+            if _NF_PENDING.match(buf, esc + 1).end() == n:
+                cut = esc
+        elif nxt < 0:
+            cut = esc
+            # A lone trailing ESC may be the first half of ST closing a string
+            prev = buf.rfind(b"\x1b", lo, esc)
+            if prev >= 0 and buf[prev + 1] in STRING_INTRODUCERS and not (
+                    buf[prev + 1] == 0x5D and buf.find(b"\x07", prev + 2, esc) >= 0):
+                cut = prev
+        # anything else is a complete two-byte sequence (including ST)
+    if cut and buf[cut - 1] >= 0x80:
+        return _utf8_boundary(buf, cut)
+    return cut
+
+
+class OutputFramer:
+    """Incremental framer: feed() raw pty bytes, get back boundary-aligned frames."""
+
+    def __init__(self):
+        self.pending = b""
+
+    def feed(self, data: bytes) -> bytes:
+        buf = self.pending + data if self.pending else data
+        # frame_boundary only looks MAX_HOLD bytes back, so a runaway
+        # sequence is eventually released rather than held forever
+        cut = frame_boundary(buf)
+        if cut == len(buf):
+            self.pending = b""
+            return buf
+        self.pending = buf[cut:]
+        return buf[:cut]
+
+    def flush(self) -> bytes:
+        # Emit whatever is held (idle timeout or process exit)
+        data, self.pending = self.pending, b""
+        return data
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Drive latency probes against a running backend and report percentiles.
+# Usage: python backend/latency_probe.py [--url ws://127.0.0.1:8000/ws] [-n 200]
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Optional
+from urllib.error import URLError
+from urllib.request import urlopen
+
+import websockets
+
+
+def percentile(sorted_values: list[float], p: float) -> Optional[float]:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(1, min(len(sorted_values), round(p / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def report(name: str, values: list[float]):
+    vals = sorted(values)
+    if not vals:
+        print(f"{name:<16}{'n/a':>10}")
+        return
+    cols = [percentile(vals, 50), percentile(vals, 90), percentile(vals, 99), vals[-1]]
+    print(f"{name:<16}{len(vals):>6}" + "".join(f"{v:>10.3f}" for v in cols))
+
+
+async def run_probes(url: str, count: int, interval: float, echo: bool,
+                     settle: float, timeout: float) -> dict[str, list[float]]:
+    samples: dict[str, list[float]] = {"rtt": [], "unaccounted": [], "loop_lag": [], "recv_to_write": [],
+                                       "write_to_echo": [], "server_total": []}
+    timeouts = 0
+    async with websockets.connect(url, max_size=None) as ws:
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def receiver():
+            async for msg in ws:
+                # Binary frames are terminal output; only probe results matter here
+                if isinstance(msg, str):
+                    try:
+                        payload = json.loads(msg)
+                    except ValueError:
+                        continue
+                    if isinstance(payload, dict) and payload.get("type") == "probe_result":
+                        await results.put((time.perf_counter(), payload))
+
+        recv_task = asyncio.create_task(receiver())
+        # Let the shell print its banner and reach a prompt
+        await asyncio.sleep(settle)
+        try:
+            for i in range(count):
+                sent = time.perf_counter()
+                await ws.send(json.dumps({"type": "probe", "id": i, "client_ts": sent * 1000.0, "echo": echo}))
+                while True:
+                    try:
+                        received, payload = await asyncio.wait_for(results.get(), timeout)
+                    except asyncio.TimeoutError:
+                        timeouts += 1
+                        break
+                    if payload.get("id") != i:
+                        continue  # late result of an earlier probe
+                    server = payload.get("server_ms", {})
+                    if "recv_to_write" in server:
+                        samples["recv_to_write"].append(server["recv_to_write"])
+                    if payload.get("timeout"):
+                        # rtt here is just the server's give-up delay, not a latency
+                        timeouts += 1
+                        break
+                    rtt = (received - sent) * 1000.0
+                    samples["rtt"].append(rtt)
+                    for hop in ("loop_lag", "write_to_echo", "server_total"):
+                        if hop in server:
+                            samples[hop].append(server[hop])
+                    # Not "network": besides the wire and the client, this includes
+                    # time the probe queued in a blocked server loop before t_recv
+                    # (see loop_lag). With --no-echo the server side ends at proc.write.
+                    server_side = server.get("server_total", server.get("recv_to_write"))
+                    if server_side is not None:
+                        samples["unaccounted"].append(max(rtt - server_side, 0.0))
+                    break
+                await asyncio.sleep(interval)
+        finally:
+            recv_task.cancel()
+    samples["_timeouts"] = [timeouts]
+    return samples
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure end-to-end keystroke echo latency of Canvas Terminal")
+    ap.add_argument("--url", default="ws://127.0.0.1:8000/ws", help="WebSocket endpoint")
+    ap.add_argument("-n", "--count", type=int, default=200, help="number of probes")
+    ap.add_argument("--interval", type=float, default=0.02, help="seconds between probes")
+    ap.add_argument("--no-echo", action="store_true", help="measure only up to proc.write (no shell echo)")
+    ap.add_argument("--settle", type=float, default=1.5, help="seconds to wait for the shell prompt")
+    ap.add_argument("--timeout", type=float, default=3.0, help="seconds to wait for each probe result")
+    ap.add_argument("--server-stats", action="store_true", help="also print the server's aggregated histograms")
+    ap.add_argument("--json", action="store_true", help="print raw samples as JSON")
+    args = ap.parse_args()
+
+    samples = asyncio.run(run_probes(args.url, args.count, args.interval, not args.no_echo,
+                                     args.settle, args.timeout))
+    timeouts = samples.pop("_timeouts")[0]
+    if args.json:
+        print(json.dumps(samples))
+        return 0
+    print(f"{'hop (ms)':<16}{'n':>6}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for name in ("rtt", "unaccounted", "loop_lag", "recv_to_write", "write_to_echo", "server_total"):
+        report(name, samples[name])
+    if timeouts:
+        print(f"[warn] {timeouts} probe(s) timed out waiting for an echo (left out of rtt/unaccounted/server_total)")
+    if args.server_stats:
+        http_url = args.url.replace("ws://", "http://").replace("wss://", "https://").rsplit("/ws", 1)[0]
+        try:
+            with urlopen(f"{http_url}/probe/stats", timeout=3) as resp:
+                print(json.dumps(json.load(resp), indent=2))
+        except (URLError, ValueError) as e:
+            print(f"[warn] could not fetch server stats: {e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,14 +6,18 @@ import shlex
 import signal
 import sys
 import select
+import time
+from collections import deque
 from pathlib import Path
 from typing import Optional
 
 from starlette.applications import Starlette
 from starlette.websockets import WebSocket, WebSocketDisconnect
-from starlette.responses import RedirectResponse
+from starlette.responses import JSONResponse, RedirectResponse
 from starlette.staticfiles import StaticFiles
 
+from framing import OutputFramer
+
 IS_WINDOWS = platform.system() == "Windows"
 # Ensure sane terminal defaults for child shells
 os.environ.setdefault("TERM", "xterm-256color")
@@ -63,6 +67,66 @@ def default_shell() -> list[str]:
     return ["/bin/sh"]
 
 
+class LatencyHistogram:
+    """Log2-bucketed latency histogram (microsecond resolution, ~1us..67s)."""
+
+    NUM_BUCKETS = 27
+
+    def __init__(self):
+        self.counts = [0] * self.NUM_BUCKETS
+        self.count = 0
+        self.total_us = 0.0
+        self.min_us: Optional[float] = None
+        self.max_us = 0.0
+
+    def record(self, seconds: float):
+        us = max(seconds * 1e6, 0.0)
+        bucket = min(int(us).bit_length(), self.NUM_BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total_us += us
+        self.min_us = us if self.min_us is None else min(self.min_us, us)
+        self.max_us = max(self.max_us, us)
+
+    def percentile(self, p: float) -> Optional[float]:
+        # Upper bound (ms) of the bucket holding the p-th percentile
+        if not self.count:
+            return None
+        rank = max(1, int(round(p / 100.0 * self.count)))
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min((1 << bucket) / 1000.0, self.max_us / 1000.0)
+        return self.max_us / 1000.0
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": (self.total_us / self.count / 1000.0) if self.count else None,
+            "min_ms": self.min_us / 1000.0 if self.min_us is not None else None,
+            "max_ms": self.max_us / 1000.0,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            # bucket i holds samples in [2**(i-1), 2**i) microseconds
+            "buckets_us": {str(1 << i): n for i, n in enumerate(self.counts) if n},
+        }
+
+
+# Server-side hops of a latency probe, aggregated across all connections
+PROBE_HOPS = ("loop_lag", "recv_to_write", "write_to_echo", "server_total")
+PROBE_STATS = {hop: LatencyHistogram() for hop in PROBE_HOPS}
+PROBE_TIMEOUT = 2.0  # seconds to wait for a probe's echo before giving up
+LOOP_LAG_INTERVAL = 0.01  # seconds between event-loop heartbeats
+LOOP_LAG_WINDOW = 0.25  # heartbeats this close to a probe's t_recv count for it
+
+
+@app.route("/probe/stats", methods=["GET"])
+def probe_stats(request):
+    return JSONResponse({hop: hist.to_dict() for hop, hist in PROBE_STATS.items()})
+
+
 class PtyProcess:
     def __init__(self, argv: Optional[list[str]] = None, cols: int = 120, rows: int = 32):
         self.argv = argv or default_shell()
@@ -184,17 +248,135 @@ async def websocket_endpoint(ws: WebSocket):
     except Exception as e:
         print(f"[pty] initial write failed: {e}")
 
+    # Latency probes awaiting their echo, keyed by the token written to the pty
+    pending_probes: dict[bytes, dict] = {}
+    echo_tail = b""
+    # (wake, lateness) of recent heartbeats, perf_counter_ns
+    lag_samples: deque = deque(maxlen=256)
+
+    async def heartbeat():
+        # A wakeup that fires late means the loop was blocked (e.g. by
+        # a blocking call); a probe arriving meanwhile waits before t_recv
+        interval = int(LOOP_LAG_INTERVAL * 1e9)
+        while True:
+            t = time.perf_counter_ns()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            now = time.perf_counter_ns()
+            lag_samples.append((now, max(now - t - interval, 0)))
+
+    def loop_lag_near(t: int) -> float:
+        # Longest stall seen by heartbeats waking near t. A stalled loop also
+        # stalls the heartbeat, so samples get sparse exactly when this
+        # matters; the window spans a few stalls on either side.
+        window = int(LOOP_LAG_WINDOW * 1e9)
+        return max((lag for wake, lag in lag_samples if abs(wake - t) <= window), default=0) / 1e9
+
+    async def finish_probe(probe: dict, t_echo: Optional[int]):
+        t_recv, t_write = probe["t_recv"], probe["t_write"]
+        hops = {"loop_lag": loop_lag_near(t_recv), "recv_to_write": (t_write - t_recv) / 1e9}
+        # A probe only has a total once its echo was seen; no-echo and timed-out
+        # probes would otherwise drag server_total down to the write hop
+        if t_echo is not None:
+            hops["write_to_echo"] = (t_echo - t_write) / 1e9
+            hops["server_total"] = (t_echo - t_recv) / 1e9
+        for hop, seconds in hops.items():
+            PROBE_STATS[hop].record(seconds)
+        await ws.send_text(json.dumps({
+            "type": "probe_result",
+            "id": probe["id"],
+            "client_ts": probe["client_ts"],
+            "timeout": probe["echo"] and t_echo is None,
+            "server_ms": {hop: seconds * 1000.0 for hop, seconds in hops.items()},
+        }))
+
+    async def match_probes(data: bytes):
+        # Called after a chunk has been sent: stamp probes whose token it echoed
+        nonlocal echo_tail
+        now = time.perf_counter_ns()
+        window = echo_tail + data
+        for token in [t for t in pending_probes if t in window]:
+            probe = pending_probes.pop(token)
+            # Erase the echoed token from the shell's input line
+            proc.write(b"\x7f" * len(token))
+            await finish_probe(probe, now)
+        echo_tail = window[-32:]
+        await expire_probes(now)
+
+    async def expire_probes(now: int):
+        # Probes written while the shell is not echoing (busy, raw mode) never match
+        for token in [t for t, p in pending_probes.items()
+                      if (now - p["t_write"]) / 1e9 > PROBE_TIMEOUT]:
+            await finish_probe(pending_probes.pop(token), None)
+
+    async def handle_probe(payload: dict):
+        t_recv = time.perf_counter_ns()
+        probe = {
+            "id": payload.get("id"),
+            "client_ts": payload.get("client_ts"),
+            "echo": bool(payload.get("echo", True)),
+            "t_recv": t_recv,
+        }
+        if probe["echo"]:
+            # A unique printable token; the tty echoes it back through reader()
+            token = b"~p" + os.urandom(4).hex().encode()
+            proc.write(token)
+            probe["t_write"] = time.perf_counter_ns()
+            pending_probes[token] = probe
+        else:
+            probe["t_write"] = time.perf_counter_ns()
+            await finish_probe(probe, None)
+
+    # Frames always end on UTF-8 character and escape-sequence boundaries
+    framer = OutputFramer()
+    # Seconds without pty output before held bytes (e.g. a lone ESC) are sent
+    IDLE_FLUSH = 0.05
+
+    async def wait_output() -> Optional[bytes]:
+        # Next pty read, or None after IDLE_FLUSH without output. Neither path
+        # blocks the event loop: POSIX waits on the fd with add_reader; the
+        # blocking pywinpty read runs in a thread, and a read still running at
+        # the timeout is kept for the next call rather than cancelled (its
+        # data would be lost).
+        nonlocal pending_read
+        if IS_WINDOWS:
+            if pending_read is None:
+                pending_read = asyncio.ensure_future(asyncio.to_thread(proc.read, 4096))
+            done, _ = await asyncio.wait({pending_read}, timeout=IDLE_FLUSH)
+            if not done:
+                return None
+            fut, pending_read = pending_read, None
+            return fut.result()
+        while True:
+            try:
+                await asyncio.wait_for(readable.wait(), IDLE_FLUSH)
+            except asyncio.TimeoutError:
+                return None
+            readable.clear()
+            # add_reader can fire again for data already read; the fd is
+            # blocking, so confirm it is still readable before reading
+            if select.select([proc.fd], [], [], 0)[0]:
+                return proc.read(4096)
+
+    pending_read: Optional[asyncio.Future] = None
+    readable = asyncio.Event()
+
     async def reader():
+        loop = asyncio.get_running_loop()
+        if not IS_WINDOWS:
+            if proc.fd is None:
+                return
+            loop.add_reader(proc.fd, readable.set)
         try:
             while proc.is_alive():
-                await asyncio.sleep(0)
-                if not IS_WINDOWS:
-                    if proc.fd is None:
-                        break
-                    r, _w, _e = select.select([proc.fd], [], [], 0.05)
-                    if not r:
-                        continue
-                data = proc.read(4096)
+                raw = await wait_output()
+                if raw is None:
+                    if framer.pending:
+                        # Idle: release a held partial sequence
+                        await ws.send_bytes(framer.flush())
+                    if pending_probes:
+                        await expire_probes(time.perf_counter_ns())
+                    continue
+                data = framer.feed(raw)
                 if data:
                     # Debug prints (trim large)
                     try:
@@ -203,10 +385,19 @@ async def websocket_endpoint(ws: WebSocket):
                         preview = str(len(data)) + " bytes"
                     print(f"[pty→ws] {len(data)} bytes: {preview!r}")
                     await ws.send_bytes(data)
+                    if pending_probes:
+                        await match_probes(data)
+            rest = framer.flush()
+            if rest:
+                await ws.send_bytes(rest)
         except Exception:
             pass
+        finally:
+            if not IS_WINDOWS and proc.fd is not None:
+                loop.remove_reader(proc.fd)
 
     read_task = asyncio.create_task(reader())
+    lag_task = asyncio.create_task(heartbeat())
 
     try:
         while True:
@@ -230,6 +421,9 @@ async def websocket_endpoint(ws: WebSocket):
                     if payload.get("type") == "resize":
                         proc.resize(int(payload.get("cols", 120)), int(payload.get("rows", 32)))
                         continue
+                    if payload.get("type") == "probe":
+                        await handle_probe(payload)
+                        continue
                 except (json.JSONDecodeError, ValueError, TypeError):
                     pass
                 # Convert to bytes; ensure CRLF handling for enter keys if needed
@@ -240,6 +434,7 @@ async def websocket_endpoint(ws: WebSocket):
         print("[ws] client disconnected")
     finally:
         read_task.cancel()
+        lag_task.cancel()
         proc.terminate()
         await asyncio.sleep(0.05)
 
@@ -1,20 +1,47 @@
 #!/usr/bin/env python3
 # A cross-platform, standalone Python shell (no external shell).
-# Features: cd/pwd/export/which, pipelines (|), redirection (> >> <), globs, env expansion.
+# Features: cd/pwd/export/which, pipelines (|), redirection (> >> <), globs, env expansion,
+# background jobs (&, jobs, wait, kill), parallel, scripts (pyshell.py script.pysh | -c cmd),
+# persistent history with fuzzy search (history -s, !?text).
 # Runs on Android (Termux Python), macOS, and Windows.
 
 from __future__ import annotations
+import errno
 import os
 import sys
 import shlex
+import signal
+import struct
 import subprocess
-import glob as pyglob
+import threading
+import time
+import fnmatch
+import atexit
 import re
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass
-from typing import List, Optional, Dict, Tuple
+from functools import lru_cache
+from typing import IO, TYPE_CHECKING, Iterable, Iterator, List, Optional, Dict, Tuple
+
+if TYPE_CHECKING:
+    # Imported where used instead: together these cost more than the rest of
+    # interactive startup
+    import mmap
+    from concurrent.futures import Future
 
 IS_WINDOWS = os.name == 'nt'
 HOME = os.path.expanduser('~')
+# posix_spawn avoids copying the page tables of a large parent; Windows and
+# some older Pythons lack it, so those fall back to subprocess.Popen.
+HAS_POSIX_SPAWN = hasattr(os, 'posix_spawn') and not IS_WINDOWS
+HAS_WAIT4 = hasattr(os, 'wait4')
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+    import msvcrt
 
 @dataclass
 class Redirection:
@@ -30,20 +57,340 @@ class Command:
     argv: List[str]
     redir: Redirection
 
-VAR_PATTERN = re.compile(r"\$(\w+)|\$\{([^}]+)\}")
+class Profiler:
+    """Per-stage timings for the command path, off unless PYSH_PROFILE/PYSH_TRACE is set.
+
+    Spans are kept as Chrome trace-event "X" records (microseconds), which
+    chrome://tracing, Perfetto and speedscope load directly; child processes
+    get their own lane with CPU times from os.wait4.
+    """
+
+    def __init__(self, enabled: bool = False, trace_path: Optional[str] = None):
+        self.enabled = enabled or bool(trace_path)
+        self.trace_path = trace_path
+        self.origin_ns = time.perf_counter_ns()
+        self.events: List[dict] = []
+        self.stats: Dict[str, List[float]] = {}  # name -> [count, total_ns, max_ns]
+        self.child_cpu = [0.0, 0.0]  # user, sys seconds
+        self._lock = threading.Lock()
+
+    def _add(self, name: str, start_ns: int, end_ns: int, pid: int, tid: int,
+             args: Optional[dict] = None) -> None:
+        dur = end_ns - start_ns
+        event = {'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                 'ts': (start_ns - self.origin_ns) / 1000, 'dur': dur / 1000}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.events.append(event)
+            st = self.stats.setdefault(name, [0, 0, 0])
+            st[0] += 1
+            st[1] += dur
+            st[2] = max(st[2], dur)
+
+    @contextmanager
+    def _span(self, name: str, args: Optional[dict]) -> Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self._add(name, start, time.perf_counter_ns(), os.getpid(), threading.get_ident(), args)
+
+    def span(self, name: str, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, args)
+
+    def process(self, stage: 'Stage', end_ns: int) -> None:
+        # One lane per child, spanning spawn -> reap, with wait4 rusage
+        args: dict = {'argv': ' '.join(stage.argv), 'exit': stage.returncode}
+        ru = stage.rusage
+        if ru is not None:
+            args.update(utime_s=ru.ru_utime, stime_s=ru.ru_stime, maxrss=ru.ru_maxrss)
+            with self._lock:
+                self.child_cpu[0] += ru.ru_utime
+                self.child_cpu[1] += ru.ru_stime
+        pid = stage.pid or (stage.popen.pid if stage.popen is not None else 0)
+        with self._lock:
+            self.events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                                'args': {'name': f"{stage.argv[0]} [{pid}]"}})
+        self._add(f"proc:{os.path.basename(stage.argv[0])}", stage.started_ns, end_ns, pid, pid, args)
+
+    def merge(self, other: 'Profiler') -> None:
+        # Fold a nested profiler (a `time` run) into this one: events are
+        # rebased onto our origin, stats and child CPU are summed
+        shift = (other.origin_ns - self.origin_ns) / 1000
+        with other._lock:
+            events = [dict(e, ts=e['ts'] + shift) if 'ts' in e else e for e in other.events]
+            stats = {name: list(st) for name, st in other.stats.items()}
+            child_user, child_sys = other.child_cpu
+        with self._lock:
+            self.events.extend(events)
+            for name, (count, total, peak) in stats.items():
+                st = self.stats.setdefault(name, [0, 0, 0])
+                st[0] += count
+                st[1] += total
+                st[2] = max(st[2], peak)
+            self.child_cpu[0] += child_user
+            self.child_cpu[1] += child_sys
+
+    def reset(self) -> None:
+        with self._lock:
+            self.events.clear()
+            self.stats.clear()
+            self.child_cpu = [0.0, 0.0]
+
+    def summary(self, out: IO[str]) -> None:
+        with self._lock:
+            rows = sorted(self.stats.items(), key=lambda kv: -kv[1][1])
+            child_user, child_sys = self.child_cpu
+        print(f"{'stage':<24}{'count':>8}{'total ms':>12}{'mean ms':>12}{'max ms':>12}", file=out)
+        for name, (count, total, peak) in rows:
+            print(f"{name:<24}{count:>8}{total / 1e6:>12.3f}{total / count / 1e6:>12.3f}{peak / 1e6:>12.3f}",
+                  file=out)
+        print(f"children: user {child_user:.3f}s sys {child_sys:.3f}s", file=out)
+
+    def write_trace(self, path: Optional[str] = None) -> Optional[str]:
+        path = path or self.trace_path
+        if not path:
+            return None
+        import json
+        with self._lock:
+            data = {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        return path
+
+
+_NULL_SPAN = nullcontext()
+PROFILER = Profiler(enabled=bool(os.environ.get('PYSH_PROFILE')),
+                    trace_path=os.environ.get('PYSH_TRACE'))
+
+
+VAR_PATTERN = re.compile(r"\$(\w+|[#@*])|\$\{([^}]+)\}")
+ALL_ARGS_WORDS = ('$@', '${@}')
+
+# $0, $1.., $#, $@ and $* for scripts and -c; only expand_vars reads these, so
+# they never reach a child's environment or `set`
+POSITIONAL: Dict[str, str] = {}
+
 
 def expand_vars(token: str, env: Dict[str, str]) -> str:
     def repl(m: re.Match[str]) -> str:
         key = m.group(1) or m.group(2) or ''
+        if key in POSITIONAL:
+            return POSITIONAL[key]
         return env.get(key, '')
     return VAR_PATTERN.sub(repl, token)
 
 
-def expand_globs(args: List[str]) -> List[str]:
+def expand_words(token: str, env: Dict[str, str]) -> List[str]:
+    # A word that is just $@ becomes one argument per positional parameter,
+    # like "$@" in sh (quotes are gone after lexing); $* always joins, like "$*"
+    if token in ALL_ARGS_WORDS:
+        return [POSITIONAL[str(i)] for i in range(1, int(POSITIONAL.get('#', '0')) + 1)]
+    return [expand_vars(token, env)]
+
+
+GLOB_MAGIC = re.compile(r'[*?[]')
+GLOB_SEPS = ('/', '\\') if IS_WINDOWS else ('/',)
+
+# Compiled segment kinds
+_SEG_LITERAL = 0
+_SEG_WILD = 1
+_SEG_RECURSIVE = 2
+_SEG_DIR = 3  # trailing separator: match directories only
+
+
+class DirCache:
+    """Directory listings shared by the globs of one command line.
+
+    Only a directory that more than one pattern lists is kept (e.g.
+    `src/*.py src/*.pyi` scans src once); every other listing, and all **
+    walks, stream straight from os.scandir so huge directories are never
+    copied into memory.
+    """
+
+    def __init__(self, shared: Iterable[str] = ()):
+        self._shared = set(shared)
+        self._listings: Dict[str, List[Tuple[str, bool]]] = {}
+
+    @classmethod
+    def for_args(cls, args: Iterable[str]) -> 'DirCache':
+        # Pre-count the directories each pattern's first wildcard lists
+        seen: set = set()
+        shared: set = set()
+        for a in args:
+            parent = _wild_parent(a) if GLOB_MAGIC.search(a) else None
+            if parent is not None:
+                (shared if parent in seen else seen).add(parent)
+        return cls(shared)
+
+    def listdir(self, path: str) -> Iterable[Tuple[str, bool]]:
+        if path not in self._shared:
+            return _scan(path)
+        listing = self._listings.get(path)
+        if listing is None:
+            listing = list(_scan(path))
+            self._listings[path] = listing
+        return listing
+
+
+# Used below ** so a large walk never pins a listing in memory
+_NO_CACHE = DirCache()
+
+
+def _scan(path: str, follow_symlinks: bool = True) -> Iterator[Tuple[str, bool]]:
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+                except OSError:
+                    is_dir = False
+                yield entry.name, is_dir
+    except OSError:
+        return
+
+
+@lru_cache(maxsize=256)
+def compile_glob(pattern: str) -> Tuple[str, Tuple[Tuple[int, object], ...]]:
+    """Split a pattern into (anchor, segments) once; matchers are precompiled regexes."""
+    drive, rest = os.path.splitdrive(pattern)
+    anchor = drive
+    while rest[:1] in GLOB_SEPS and rest:
+        anchor += rest[0]
+        rest = rest[1:]
+    parts = re.split('|'.join(re.escape(c) for c in GLOB_SEPS), rest) if rest else []
+    flags = re.IGNORECASE if IS_WINDOWS else 0
+    segs: List[Tuple[int, object]] = []
+    for i, part in enumerate(parts):
+        if part == '':
+            if i == len(parts) - 1 and segs:
+                segs.append((_SEG_DIR, None))
+            continue  # collapse 'a//b'
+        if part == '**':
+            if segs and segs[-1][0] == _SEG_RECURSIVE:
+                continue
+            segs.append((_SEG_RECURSIVE, None))
+        elif GLOB_MAGIC.search(part):
+            segs.append((_SEG_WILD, (re.compile(fnmatch.translate(part), flags).match,
+                                     part.startswith('.'))))
+        else:
+            segs.append((_SEG_LITERAL, part))
+    return anchor, tuple(segs)
+
+
+def _wild_parent(pattern: str) -> Optional[str]:
+    # Directory listed by the first wildcard segment, as _iglob will name it;
+    # None when a ** comes first (those walks are never cached)
+    base, segs = compile_glob(pattern)
+    for kind, val in segs:
+        if kind == _SEG_LITERAL:
+            base = _join(base, val)  # type: ignore[arg-type]
+        elif kind == _SEG_WILD:
+            return base or os.curdir
+        else:
+            return None
+    return None
+
+
+def _join(base: str, name: str) -> str:
+    return base + name if not base or base.endswith(GLOB_SEPS) else base + os.sep + name
+
+
+def _walk_dirs(base: str) -> Iterator[str]:
+    # Lazily yield every subdirectory; hidden dirs and symlinked dirs are
+    # not descended (the latter avoids cycles).
+    stack = [base]
+    while stack:
+        top = stack.pop()
+        for name, is_dir in _scan(top or os.curdir, follow_symlinks=False):
+            if is_dir and name[0] != '.':
+                path = _join(top, name)
+                yield path
+                stack.append(path)
+
+
+def _iglob(base: str, segs: Tuple[Tuple[int, object], ...], i: int,
+           cache: DirCache) -> Iterator[str]:
+    if i == len(segs):
+        yield base
+        return
+    kind, val = segs[i]
+    last = i == len(segs) - 1
+    if kind == _SEG_LITERAL:
+        path = _join(base, val)  # type: ignore[arg-type]
+        if last:
+            if os.path.lexists(path):
+                yield path
+        elif os.path.isdir(path):
+            yield from _iglob(path, segs, i + 1, cache)
+    elif kind == _SEG_DIR:
+        if base and os.path.isdir(base):
+            yield base + os.sep
+    elif kind == _SEG_WILD:
+        match, dot_ok = val  # type: ignore[misc]
+        for name, is_dir in cache.listdir(base or os.curdir):
+            if (name[0] == '.' and not dot_ok) or not match(name):
+                continue
+            if last:
+                yield _join(base, name)
+            elif is_dir:
+                yield from _iglob(_join(base, name), segs, i + 1, cache)
+    else:  # recursive **
+        if last:
+            # trailing ** matches the directory itself and every descendant
+            if base:
+                yield base if base.endswith(GLOB_SEPS) else base + os.sep
+            yield from _iter_tree(base)
+            return
+        nxt_kind, nxt_val = segs[i + 1]
+        if i + 2 == len(segs) and nxt_kind == _SEG_WILD:
+            # Common `**/*.py` shape: one streaming scandir pass per directory
+            match, dot_ok = nxt_val  # type: ignore[misc]
+            for d in _chain_one(base, _walk_dirs(base)):
+                for name, _is_dir in _scan(d or os.curdir):
+                    if (name[0] != '.' or dot_ok) and match(name):
+                        yield _join(d, name)
+            return
+        # ** matches zero or more directories
+        for d in _chain_one(base, _walk_dirs(base)):
+            yield from _iglob(d, segs, i + 1, _NO_CACHE)
+
+
+def _chain_one(first: str, rest: Iterator[str]) -> Iterator[str]:
+    yield first
+    yield from rest
+
+
+def _iter_tree(base: str) -> Iterator[str]:
+    stack = [base]
+    while stack:
+        top = stack.pop()
+        for name, is_dir in _scan(top or os.curdir, follow_symlinks=False):
+            if name.startswith('.'):
+                continue
+            path = _join(top, name)
+            yield path
+            if is_dir:
+                stack.append(path)
+
+
+def iglob(pattern: str, cache: Optional[DirCache] = None) -> Iterator[str]:
+    """Lazily yield paths matching pattern; supports recursive **."""
+    anchor, segs = compile_glob(pattern)
+    if not segs:
+        return iter(())
+    return _iglob(anchor, segs, 0, cache or _NO_CACHE)
+
+
+def expand_globs(args: List[str], cache: Optional[DirCache] = None) -> List[str]:
     expanded: List[str] = []
+    cache = cache or DirCache.for_args(args)
     for a in args:
-        if any(ch in a for ch in ['*', '?', '[']):
-            matches = pyglob.glob(a)
+        if GLOB_MAGIC.search(a):
+            matches = sorted(iglob(a, cache))
             if matches:
                 expanded.extend(matches)
             else:
@@ -53,7 +400,13 @@ def expand_globs(args: List[str]) -> List[str]:
     return expanded
 
 
-def parse_pipeline(cmd_str: str, env: Dict[str, str]) -> List[Command]:
+# Bump whenever lex_pipeline/split_commands output changes; invalidates script caches
+PARSER_VERSION = 3
+SCRIPT_CACHE_SUFFIX = 'c'  # script.pysh -> script.pyshc, like .py -> .pyc
+
+
+def lex_pipeline(cmd_str: str) -> List[List[str]]:
+    """Tokenize one command into per-stage token lists (no expansion)."""
     # Split by '|' respecting quotes via shlex
     parts: List[str] = []
     buf = ''
@@ -69,14 +422,17 @@ def parse_pipeline(cmd_str: str, env: Dict[str, str]) -> List[Command]:
                 level ^= 1
     if buf.strip():
         parts.append(buf.strip())
+    return [shlex.split(part, posix=not IS_WINDOWS) for part in parts]
 
-    pipeline: List[Command] = []
-    for part in parts:
-        tokens = shlex.split(part, posix=not IS_WINDOWS)
-        tokens = [expand_vars(t, env) for t in tokens]
+
+def build_pipeline(stages: List[List[str]], env: Dict[str, str]) -> List[Command]:
+    """Expand variables, redirections and globs of lexed stages."""
+    words: List[Tuple[List[str], Redirection]] = []
+    for tokens in stages:
+        with PROFILER.span('expand_vars'):
+            tokens = [w for t in tokens for w in expand_words(t, env)]
         redir = Redirection()
         argv: List[str] = []
-        it = iter(range(len(tokens)))
         i = 0
         while i < len(tokens):
             t = tokens[i]
@@ -108,35 +464,75 @@ def parse_pipeline(cmd_str: str, env: Dict[str, str]) -> List[Command]:
                 redir.stderr_to_stdout = True
                 i += 1
                 continue
+            if t.startswith('&>'):
+                # '&> f' / '&>> f' (or '&>f'): stdout and stderr to the same file
+                append = t.startswith('&>>')
+                target = t[3 if append else 2:]
+                if not target:
+                    if i + 1 >= len(tokens):
+                        raise ValueError(f"{t}: missing file name")
+                    target = tokens[i + 1]
+                    i += 1
+                redir.stdout = target
+                redir.stdout_append = append
+                redir.stderr_to_stdout = True
+                i += 1
+                continue
             argv.append(t)
             i += 1
-        argv = expand_globs(argv)
+        words.append((argv, redir))
+    # One cache for the whole line, holding only directories two globs share
+    cache = DirCache.for_args(a for argv, _redir in words for a in argv)
+    pipeline: List[Command] = []
+    for argv, redir in words:
+        with PROFILER.span('expand_globs'):
+            argv = expand_globs(argv, cache)
         pipeline.append(Command(argv=argv, redir=redir))
     return pipeline
 
 
-BUILTINS = ('cd', 'pwd', 'exit', 'set', 'export', 'which')
+def parse_pipeline(cmd_str: str, env: Dict[str, str]) -> List[Command]:
+    return build_pipeline(lex_pipeline(cmd_str), env)
+
+
+BUILTINS = ('cd', 'pwd', 'exit', 'set', 'export', 'which', 'jobs', 'wait', 'kill', 'parallel',
+            'history', 'profile')
+# Builtins that consume stdin; all others close it straight away in a pipeline
+STDIN_BUILTINS = ('parallel',)
 
-def run_builtin(argv: List[str], env: Dict[str, str]) -> int:
+def run_builtin(argv: List[str], env: Dict[str, str],
+                stdout: Optional[IO[str]] = None, stderr: Optional[IO[str]] = None,
+                subshell: bool = False, stdin: Optional[IO[str]] = None) -> int:
+    # subshell=True mirrors POSIX shells running pipeline members in a child:
+    # cd/exit/export must not leak into the interactive shell.
+    out = stdout or sys.stdout
+    err = stderr or sys.stderr
     cmd = argv[0]
     if cmd == 'cd':
-        target = argv[1] if len(argv) > 1 else env.get('HOME', HOME)
+        target = os.path.expanduser(argv[1] if len(argv) > 1 else env.get('HOME', HOME))
+        if subshell:
+            if os.path.isdir(target):
+                return 0
+            print(f"cd: no such directory: {target}", file=err)
+            return 1
         try:
-            os.chdir(os.path.expanduser(target))
+            os.chdir(target)
             return 0
         except Exception as e:
-            print(f"cd: {e}", file=sys.stderr)
+            print(f"cd: {e}", file=err)
             return 1
     if cmd == 'pwd':
-        print(os.getcwd())
+        print(os.getcwd(), file=out)
         return 0
     if cmd == 'exit':
         code = int(argv[1]) if len(argv) > 1 and argv[1].isdigit() else 0
+        if subshell:
+            return code
         sys.exit(code)
     if cmd == 'set':
         if len(argv) == 1:
             for k, v in env.items():
-                print(f"{k}={v}")
+                print(f"{k}={v}", file=out)
             return 0
         for item in argv[1:]:
             if '=' in item:
@@ -148,16 +544,29 @@ def run_builtin(argv: List[str], env: Dict[str, str]) -> int:
             if '=' in item:
                 k, v = item.split('=', 1)
                 env[k] = v
-                os.environ[k] = v
+                if not subshell:
+                    os.environ[k] = v
         return 0
     if cmd == 'which':
         for a in argv[1:]:
             path = shutil_which(a)
             if path:
-                print(path)
+                print(path, file=out)
             else:
-                print(f"which: no {a} in PATH", file=sys.stderr)
+                print(f"which: no {a} in PATH", file=err)
         return 0
+    if cmd == 'jobs':
+        return builtin_jobs(argv, out, err)
+    if cmd == 'wait':
+        return builtin_wait(argv, err)
+    if cmd == 'kill':
+        return builtin_kill(argv, err)
+    if cmd == 'parallel':
+        return builtin_parallel(argv, env, stdin or sys.stdin, out, err)
+    if cmd == 'history':
+        return builtin_history(argv, out, err)
+    if cmd == 'profile':
+        return builtin_profile(argv, out, err)
     return 1
 
 
@@ -179,82 +588,623 @@ def shutil_which(cmd: str) -> Optional[str]:
     return None
 
 
-def launch_pipeline(pipeline: List[Command], env: Dict[str, str]) -> int:
-    num = len(pipeline)
-    procs: List[subprocess.Popen] = []
-    prev_stdout = None
-    for idx, cmd in enumerate(pipeline):
-        if not cmd.argv:
-            continue
-        # Builtins only valid when single command and no pipe
-        if num == 1 and cmd.argv[0] in BUILTINS:
-            return run_builtin(cmd.argv, env)
-        stdin = None
-        stdout = None
-        stderr = None
-        # stdin redirection
-        if cmd.redir.stdin:
-            stdin = open(cmd.redir.stdin, 'rb')
-        elif prev_stdout is not None:
-            stdin = prev_stdout
-        # stdout redirection or pipe
-        if idx < num - 1:
-            stdout = subprocess.PIPE
-        elif cmd.redir.stdout:
-            mode = 'ab' if cmd.redir.stdout_append else 'wb'
-            stdout = open(cmd.redir.stdout, mode)
-        # stderr
-        if cmd.redir.stderr_to_stdout:
-            stderr = subprocess.STDOUT
-        elif cmd.redir.stderr:
-            mode = 'ab' if cmd.redir.stderr_append else 'wb'
-            stderr = open(cmd.redir.stderr, mode)
-        # Resolve executable
-        exe = cmd.argv[0]
-        if not os.path.isabs(exe):
-            located = shutil_which(exe)
-            if located:
-                exe = located
+class Stage:
+    """A started pipeline member: a spawned child pid, a Popen, or a builtin thread."""
+
+    def __init__(self, argv: List[str], pid: Optional[int] = None,
+                 popen: Optional[subprocess.Popen] = None,
+                 thread: Optional[threading.Thread] = None,
+                 returncode: Optional[int] = None,
+                 started_ns: Optional[int] = None):
+        self.argv = argv
+        self.pid = pid
+        self.popen = popen
+        self.thread = thread
+        self.returncode = returncode
+        # Spawners pass the time taken before the fork so the process lane
+        # covers spawn -> reap rather than starting once spawn has returned
+        self.started_ns = started_ns if started_ns is not None else time.perf_counter_ns()
+        self.rusage = None  # resource.struct_rusage once reaped via wait4
+
+    def _reaped(self, status: int, rusage) -> None:
+        self.returncode = os.waitstatus_to_exitcode(status)
+        self.rusage = rusage
+        if PROFILER.enabled:
+            PROFILER.process(self, time.perf_counter_ns())
+
+    def wait(self) -> int:
+        if self.returncode is not None:
+            return self.returncode
+        if self.pid is not None:
+            with PROFILER.span('wait', pid=self.pid):
+                if HAS_WAIT4:
+                    _pid, status, rusage = os.wait4(self.pid, 0)
+                else:
+                    _pid, status = os.waitpid(self.pid, 0)
+                    rusage = None
+            self._reaped(status, rusage)
+        elif self.popen is not None:
+            with PROFILER.span('wait', pid=self.popen.pid):
+                self.returncode = self.popen.wait()
+            if PROFILER.enabled:
+                PROFILER.process(self, time.perf_counter_ns())
+        elif self.thread is not None:
+            with PROFILER.span('wait'):
+                self.thread.join()
+            # the thread stores its exit code in self.returncode
+        if self.returncode is None:
+            self.returncode = 0
+        return self.returncode
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is not None:
+            return self.returncode
+        if self.pid is not None:
+            try:
+                if HAS_WAIT4:
+                    pid, status, rusage = os.wait4(self.pid, os.WNOHANG)
+                else:
+                    (pid, status), rusage = os.waitpid(self.pid, os.WNOHANG), None
+            except ChildProcessError:
+                self.returncode = 0
+                return 0
+            if pid == 0:
+                return None
+            self._reaped(status, rusage)
+        elif self.popen is not None:
+            self.returncode = self.popen.poll()
+        elif self.thread is not None:
+            if self.thread.is_alive():
+                return None
+            if self.returncode is None:
+                self.returncode = 0
+        return self.returncode
+
+
+def _open_redirect(path: str, append: bool) -> int:
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if append else os.O_TRUNC)
+    return os.open(path, flags, 0o666)
+
+
+def _close_fds(fds: List[int]) -> None:
+    for fd in fds:
         try:
-            p = subprocess.Popen(
-                [exe] + cmd.argv[1:],
-                stdin=stdin,
-                stdout=stdout or sys.stdout.buffer,
-                stderr=stderr or sys.stderr.buffer,
-                env=env,
-                cwd=os.getcwd(),
-                shell=False,
-            )
-        except FileNotFoundError:
-            print(f"command not found: {cmd.argv[0]}", file=sys.stderr)
-            # Close inherited pipe from prev to avoid hanging
-            if prev_stdout and prev_stdout is not sys.stdin.buffer:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def spawn_external(argv: List[str], env: Dict[str, str],
+                   stdin_fd: int, stdout_fd: int, stderr_fd: int,
+                   pgroup: Optional[int] = None) -> Stage:
+    # Resolve executable; posix_spawn needs a path, not a bare name
+    exe = argv[0]
+    if not os.path.isabs(exe) and os.sep not in exe:
+        with PROFILER.span('which', cmd=exe):
+            located = shutil_which(exe)
+        if located is None:
+            raise FileNotFoundError(exe)
+        exe = located
+    with PROFILER.span('spawn', cmd=exe):
+        return _spawn(exe, argv, env, stdin_fd, stdout_fd, stderr_fd, pgroup)
+
+
+def _spawn(exe: str, argv: List[str], env: Dict[str, str],
+           stdin_fd: int, stdout_fd: int, stderr_fd: int,
+           pgroup: Optional[int]) -> Stage:
+    started = time.perf_counter_ns()
+    if HAS_POSIX_SPAWN:
+        # Pipe and redirect fds are non-inheritable (PEP 446), so only the
+        # dup2 onto 0/1/2 survives exec; no close actions are needed.
+        actions = []
+        for fd, target in ((stdin_fd, 0), (stdout_fd, 1), (stderr_fd, 2)):
+            if fd != target:
+                actions.append((os.POSIX_SPAWN_DUP2, fd, target))
+        kwargs = {}
+        if pgroup is not None:
+            kwargs['setpgroup'] = pgroup
+        pid = os.posix_spawn(
+            exe, argv, env,
+            file_actions=actions,
+            # Python ignores SIGPIPE; children must get the default back
+            setsigdef=(signal.SIGPIPE, signal.SIGXFSZ),
+            **kwargs,
+        )
+        return Stage(argv, pid=pid, started_ns=started)
+    p = subprocess.Popen(
+        [exe] + argv[1:],
+        stdin=stdin_fd,
+        stdout=stdout_fd,
+        stderr=stderr_fd,
+        env=env,
+        cwd=os.getcwd(),
+        shell=False,
+    )
+    return Stage(argv, popen=p, started_ns=started)
+
+
+def _run_builtin_thread(stage: Stage, argv: List[str], env: Dict[str, str],
+                        stdin_fd: int, stdout_fd: int, stderr_fd: int,
+                        owned: List[int]) -> None:
+    out = err = inp = None
+    try:
+        if argv[0] in STDIN_BUILTINS:
+            inp = os.fdopen(stdin_fd, 'r', closefd=stdin_fd in owned)
+        elif stdin_fd in owned:
+            # Builtins that ignore stdin close it early so the upstream
+            # writer gets EPIPE/SIGPIPE just like with a real child.
+            os.close(stdin_fd)
+            owned.remove(stdin_fd)
+        out = os.fdopen(stdout_fd, 'w', closefd=stdout_fd in owned)
+        if stderr_fd == stdout_fd:
+            err = out
+        else:
+            err = os.fdopen(stderr_fd, 'w', closefd=stderr_fd in owned)
+        with PROFILER.span(f"builtin:{argv[0]}"):
+            stage.returncode = run_builtin(argv, env, stdout=out, stderr=err,
+                                           subshell=True, stdin=inp)
+    except BrokenPipeError:
+        stage.returncode = 1
+    finally:
+        for f in (inp, out, err):
+            if f is not None:
                 try:
-                    prev_stdout.close()  # type: ignore
-                except Exception:
+                    f.close()
+                except OSError:
                     pass
-            return 127
-        if prev_stdout and prev_stdout is not sys.stdin.buffer:
+
+
+def start_pipeline(pipeline: List[Command], env: Dict[str, str],
+                   background: bool = False) -> List[Stage]:
+    """Wire stages with os.pipe and start every member without waiting.
+
+    Externals are launched via posix_spawn (Popen fallback); builtins run on
+    a thread writing into their pipe, against a copy of env. Background
+    pipelines read /dev/null and get their own process group, so terminal
+    Ctrl-C only reaches the foreground job.
+    """
+    cmds = [c for c in pipeline if c.argv]
+    stages: List[Stage] = []
+    num = len(cmds)
+    prev_read: Optional[int] = None
+    pgid: Optional[int] = None
+    for idx, cmd in enumerate(cmds):
+        owned: List[int] = []  # fds this stage must close once started
+        next_read: Optional[int] = None
+        try:
+            # stdin: redirection, previous pipe, or the shell's own stdin
+            if cmd.redir.stdin:
+                stdin_fd = os.open(cmd.redir.stdin, os.O_RDONLY)
+                owned.append(stdin_fd)
+                if prev_read is not None:
+                    owned.append(prev_read)
+            elif prev_read is not None:
+                stdin_fd = prev_read
+                owned.append(prev_read)
+            elif background:
+                stdin_fd = os.open(os.devnull, os.O_RDONLY)
+                owned.append(stdin_fd)
+            else:
+                stdin_fd = 0
+            prev_read = None
+            # stdout: pipe to the next stage, redirection, or inherited
+            if idx < num - 1:
+                next_read, stdout_fd = os.pipe()
+                owned.append(stdout_fd)
+                if cmd.redir.stdout:
+                    # `a > f | b`: b sees EOF, output goes to f
+                    owned.remove(stdout_fd)
+                    os.close(stdout_fd)
+                    stdout_fd = _open_redirect(cmd.redir.stdout, cmd.redir.stdout_append)
+                    owned.append(stdout_fd)
+            elif cmd.redir.stdout:
+                stdout_fd = _open_redirect(cmd.redir.stdout, cmd.redir.stdout_append)
+                owned.append(stdout_fd)
+            else:
+                stdout_fd = 1
+            # stderr
+            if cmd.redir.stderr_to_stdout:
+                stderr_fd = stdout_fd
+            elif cmd.redir.stderr:
+                stderr_fd = _open_redirect(cmd.redir.stderr, cmd.redir.stderr_append)
+                owned.append(stderr_fd)
+            else:
+                stderr_fd = 2
+        except OSError as e:
+            print(f"{cmd.argv[0]}: {e}", file=sys.stderr)
+            _close_fds(owned)
+            stages.append(Stage(cmd.argv, returncode=1))
+            prev_read = next_read
+            continue
+
+        if cmd.argv[0] in BUILTINS:
+            stage = Stage(cmd.argv)
+            t = threading.Thread(
+                target=_run_builtin_thread,
+                args=(stage, cmd.argv, dict(env), stdin_fd, stdout_fd, stderr_fd, owned),
+                daemon=True,
+            )
+            stage.thread = t
+            t.start()
+            # the thread now owns (and closes) the fds
+        else:
             try:
-                prev_stdout.close()
-            except Exception:
-                pass
-        prev_stdout = p.stdout if p.stdout else None
-        procs.append(p)
+                stage = spawn_external(cmd.argv, env, stdin_fd, stdout_fd, stderr_fd,
+                                       pgroup=(pgid or 0) if background else None)
+                if background and pgid is None:
+                    pgid = stage.pid
+            except FileNotFoundError:
+                print(f"command not found: {cmd.argv[0]}", file=sys.stderr)
+                stage = Stage(cmd.argv, returncode=127)
+            except OSError as e:
+                print(f"{cmd.argv[0]}: {e}", file=sys.stderr)
+                stage = Stage(cmd.argv, returncode=126)
+            _close_fds(owned)
+        stages.append(stage)
+        prev_read = next_read
+    if prev_read is not None:
+        os.close(prev_read)
+    return stages
+
+
+def wait_pipeline(stages: List[Stage]) -> int:
     # Wait and propagate last exit code
     last_code = 0
-    for p in procs:
-        p.wait()
-        last_code = p.returncode
+    for stage in stages:
+        last_code = stage.wait()
     return last_code
 
 
-def split_commands(line: str) -> List[str]:
-    # split on ';' but not inside quotes
-    result: List[str] = []
+def launch_pipeline(pipeline: List[Command], env: Dict[str, str],
+                    background: bool = False, label: str = '', timed: bool = False) -> int:
+    cmds = [c for c in pipeline if c.argv]
+    if not cmds:
+        return 0
+    # A lone foreground builtin runs in-process so cd/export/exit affect this shell
+    if not background and len(cmds) == 1 and cmds[0].argv[0] in BUILTINS:
+        with PROFILER.span(f"builtin:{cmds[0].argv[0]}"):
+            return _run_builtin_inline(cmds[0], env)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with PROFILER.span('start_pipeline', stages=len(cmds)):
+        stages = start_pipeline(cmds, env, background=background)
+    if background:
+        add_job(label or ' | '.join(' '.join(c.argv) for c in cmds), stages, timed)
+        return 0
+    return wait_pipeline(stages)
+
+
+def _run_builtin_inline(cmd: Command, env: Dict[str, str]) -> int:
+    out: Optional[IO[str]] = None
+    err: Optional[IO[str]] = None
+    inp: Optional[IO[str]] = None
+    try:
+        if cmd.redir.stdin:
+            inp = open(cmd.redir.stdin, 'r')
+        if cmd.redir.stdout:
+            out = open(cmd.redir.stdout, 'a' if cmd.redir.stdout_append else 'w')
+        if cmd.redir.stderr_to_stdout:
+            err = out
+        elif cmd.redir.stderr:
+            err = open(cmd.redir.stderr, 'a' if cmd.redir.stderr_append else 'w')
+        return run_builtin(cmd.argv, env, stdout=out, stderr=err, stdin=inp)
+    except OSError as e:
+        print(f"{cmd.argv[0]}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        for f in {id(f): f for f in (inp, out, err) if f is not None}.values():
+            f.close()
+
+
+class Job:
+    """A background pipeline tracked in the job table."""
+
+    def __init__(self, job_id: int, label: str, stages: List[Stage], timed: bool = False):
+        self.job_id = job_id
+        self.label = label
+        self.stages = stages
+        self.timed = timed  # `time cmd &`: report times when the job is reaped
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self._code: Optional[int] = None
+        self._watcher: Optional[threading.Thread] = None
+        if timed:
+            # Reaping happens at the next prompt; a watcher notes the real end
+            self._watcher = threading.Thread(target=self._watch, daemon=True)
+            self._watcher.start()
+
+    def _watch(self) -> None:
+        self._code = wait_pipeline(self.stages)
+        self.finished = time.monotonic()
+
+    @property
+    def pids(self) -> List[int]:
+        return [s.pid if s.pid is not None else s.popen.pid
+                for s in self.stages if s.pid is not None or s.popen is not None]
+
+    def poll(self) -> Optional[int]:
+        if self._watcher is not None:
+            return None if self._watcher.is_alive() else self._code
+        codes = [s.poll() for s in self.stages]
+        if any(c is None for c in codes):
+            return None
+        return codes[-1] if codes else 0
+
+    def wait(self) -> int:
+        if self._watcher is not None:
+            self._watcher.join()
+            return self._code or 0
+        return wait_pipeline(self.stages)
+
+    def report_times(self) -> None:
+        # Children's CPU comes from wait4; without it only real time is known
+        usages = [s.rusage for s in self.stages if s.rusage is not None]
+        _print_times((self.finished or time.monotonic()) - self.started,
+                     sum(ru.ru_utime for ru in usages), sum(ru.ru_stime for ru in usages),
+                     prefix=f"[{self.job_id}] ")
+
+    def signal(self, sig: int) -> None:
+        for pid in self.pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+
+JOBS: Dict[int, Job] = {}
+
+
+def add_job(label: str, stages: List[Stage], timed: bool = False) -> Job:
+    job_id = max(JOBS) + 1 if JOBS else 1
+    job = Job(job_id, label, stages, timed)
+    JOBS[job_id] = job
+    pids = job.pids
+    print(f"[{job_id}] {pids[-1] if pids else ''}".rstrip(), file=sys.stderr)
+    return job
+
+
+def reap_jobs() -> None:
+    # Report and forget finished background jobs, like bash before a prompt
+    for job_id in sorted(JOBS):
+        job = JOBS[job_id]
+        code = job.poll()
+        if code is None:
+            continue
+        status = 'Done' if code == 0 else f"Exit {code}"
+        print(f"[{job_id}]  {status:<10}{job.label}", file=sys.stderr)
+        if job.timed:
+            job.report_times()
+        del JOBS[job_id]
+
+
+def _resolve_job(spec: str) -> Optional[Job]:
+    if spec in ('%', '%%', '%+'):
+        return JOBS[max(JOBS)] if JOBS else None
+    if spec.startswith('%') and spec[1:].isdigit():
+        return JOBS.get(int(spec[1:]))
+    return None
+
+
+def builtin_jobs(argv: List[str], out: IO[str], err: IO[str]) -> int:
+    show_pids = '-l' in argv[1:]
+    for job_id in sorted(JOBS):
+        job = JOBS[job_id]
+        code = job.poll()
+        status = 'Running' if code is None else ('Done' if code == 0 else f"Exit {code}")
+        pids = ' '.join(str(p) for p in job.pids) + ' ' if show_pids else ''
+        print(f"[{job_id}]  {pids}{status:<10}{job.label}", file=out)
+    return 0
+
+
+def builtin_wait(argv: List[str], err: IO[str]) -> int:
+    targets: List[Job] = []
+    for spec in argv[1:]:
+        job = _resolve_job(spec)
+        if job is None and spec.isdigit():
+            job = next((j for j in JOBS.values() if int(spec) in j.pids), None)
+        if job is None:
+            print(f"wait: {spec}: no such job", file=err)
+            return 127
+        targets.append(job)
+    if len(argv) == 1:
+        targets = [JOBS[k] for k in sorted(JOBS)]
+    code = 0
+    try:
+        for job in targets:
+            code = job.wait()
+            if job.timed:
+                job.report_times()
+            JOBS.pop(job.job_id, None)
+    except KeyboardInterrupt:
+        return 130
+    return code
+
+
+def _parse_signal(name: str) -> int:
+    if name.isdigit():
+        return int(name)
+    name = name.upper()
+    if not name.startswith('SIG'):
+        name = 'SIG' + name
+    return int(getattr(signal, name))
+
+
+def builtin_kill(argv: List[str], err: IO[str]) -> int:
+    sig = signal.SIGTERM
+    args = argv[1:]
+    try:
+        if args and args[0] == '-s' and len(args) > 1:
+            sig = _parse_signal(args[1])
+            args = args[2:]
+        elif args and args[0].startswith('-') and len(args[0]) > 1:
+            sig = _parse_signal(args[0][1:])
+            args = args[1:]
+    except (AttributeError, ValueError):
+        print(f"kill: {args[0]}: invalid signal", file=err)
+        return 2
+    if not args:
+        print("usage: kill [-s sig | -sig] %job | pid ...", file=err)
+        return 2
+    code = 0
+    for spec in args:
+        try:
+            if spec.startswith('%'):
+                job = _resolve_job(spec)
+                if job is None:
+                    print(f"kill: {spec}: no such job", file=err)
+                    code = 1
+                    continue
+                job.signal(sig)
+            else:
+                os.kill(int(spec), sig)
+        except (OSError, ValueError) as e:
+            print(f"kill: {spec}: {e}", file=err)
+            code = 1
+    return code
+
+
+def _write_bytes(stream: IO[str], data: bytes) -> None:
+    buf = getattr(stream, 'buffer', None)
+    if buf is not None:
+        stream.flush()
+        buf.write(data)
+        buf.flush()
+    else:
+        stream.write(data.decode('utf-8', errors='replace'))
+
+
+def builtin_parallel(argv: List[str], env: Dict[str, str],
+                     stdin: IO[str], out: IO[str], err: IO[str]) -> int:
+    """xargs -P style fan-out: parallel [-j N] [-k] [-t] [--] cmd [args...]
+
+    Runs cmd once per non-empty stdin line, substituting {} (or appending the
+    line when there is no {}). Output of each job is emitted whole, as jobs
+    complete or in input order with -k; -t reports per-job timing on stderr.
+    """
+    workers = os.cpu_count() or 1
+    keep_order = False
+    timing = False
+    i = 1
+    while i < len(argv):
+        a = argv[i]
+        if a == '--':
+            i += 1
+            break
+        if a in ('-j', '--jobs') and i + 1 < len(argv):
+            a = '-j' + argv[i + 1]
+            i += 1
+        if a.startswith('-j'):
+            if not a[2:].isdigit() or int(a[2:]) < 1:
+                print(f"parallel: invalid job count: {a[2:]}", file=err)
+                return 2
+            workers = int(a[2:])
+        elif a in ('-k', '--keep-order'):
+            keep_order = True
+        elif a in ('-t', '--timing'):
+            timing = True
+        else:
+            break
+        i += 1
+    template = argv[i:]
+    if not template:
+        print("usage: parallel [-j N] [-k] [-t] [--] command [args...]", file=err)
+        return 2
+    substitute = any('{}' in t for t in template)
+
+    err.flush()
+    err_fd = err.fileno() if hasattr(err, 'fileno') else 2
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+
+    def run_one(n: int, line: str) -> Tuple[int, List[str], bytes, int, float]:
+        cmd = [t.replace('{}', line) for t in template] if substitute else template + [line]
+        t0 = time.perf_counter()
+        r, w = os.pipe()
+        try:
+            stage = spawn_external(cmd, env, null_fd, w, err_fd)
+        except OSError as e:
+            os.close(r)
+            print(f"parallel: {cmd[0]}: {'command not found' if isinstance(e, FileNotFoundError) else e}", file=err)
+            return n, cmd, b'', 127, time.perf_counter() - t0
+        finally:
+            os.close(w)
+        with os.fdopen(r, 'rb') as f:
+            data = f.read()
+        code = stage.wait()
+        return n, cmd, data, code, time.perf_counter() - t0
+
+    failed = 0
+    total = 0
+    started = time.perf_counter()
+
+    # Results are reported from done-callbacks, so they stream out as jobs
+    # finish even while the stdin loop is blocked waiting for the next line.
+    lock = threading.Lock()
+    window = threading.Semaphore(workers * 2)  # bounds queued + held results
+    ready: Dict[int, Future] = {}
+    next_out = 0
+
+    def report(fut: Future) -> None:
+        nonlocal failed
+        try:
+            n, cmd, data, code, elapsed = fut.result()
+        except Exception as e:
+            print(f"parallel: {e}", file=err)
+            failed += 1
+            return
+        if data:
+            _write_bytes(out, data)
+        if code != 0:
+            failed += 1
+        if timing:
+            print(f"[parallel] #{n + 1} exit={code} {elapsed:.3f}s {' '.join(cmd)}", file=err)
+
+    def on_done(n: int, fut: Future) -> None:
+        nonlocal next_out
+        with lock:
+            if not keep_order:
+                report(fut)
+                window.release()
+                return
+            # -k: flush the run of consecutive finished jobs
+            ready[n] = fut
+            while next_out in ready:
+                report(ready.pop(next_out))
+                window.release()
+                next_out += 1
+
+    from concurrent.futures import ThreadPoolExecutor
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for raw in stdin:
+                line = raw.rstrip('\r\n')
+                if not line:
+                    continue
+                window.acquire()
+                fut = pool.submit(run_one, total, line)
+                fut.add_done_callback(lambda f, n=total: on_done(n, f))
+                total += 1
+    finally:
+        os.close(null_fd)
+    if timing:
+        print(f"[parallel] {total} jobs, {failed} failed, {time.perf_counter() - started:.3f}s wall, "
+              f"{workers} workers", file=err)
+    return 1 if failed else 0
+
+
+def split_commands(line: str) -> List[Tuple[str, bool]]:
+    # split on ';' and '&' but not inside quotes; returns (command, background)
+    result: List[Tuple[str, bool]] = []
     buf = ''
     q = None
-    for ch in line:
+    i = 0
+    n = len(line)
+    while i < n:
+        ch = line[i]
+        if ch == '\\' and q != "'" and not IS_WINDOWS and i + 1 < n:
+            # keep the escape for shlex; the escaped char is never a separator
+            buf += line[i:i + 2]
+            i += 2
+            continue
         if ch in ('"', "'"):
             if q is None:
                 q = ch
@@ -262,20 +1212,594 @@ def split_commands(line: str) -> List[str]:
                 q = None
         if ch == ';' and q is None:
             if buf.strip():
-                result.append(buf.strip())
+                result.append((buf.strip(), False))
+            buf = ''
+        elif ch == '&' and q is None and line[i + 1:i + 2] == '&':
+            # '&&' is never a job separator, and and-lists are not implemented
+            raise ValueError("'&&' is not supported; use ';' or separate lines")
+        elif ch == '&' and q is None and not buf.endswith(('>', '<')) and line[i + 1:i + 2] != '>':
+            # '2>&1' and '&>' (see build_pipeline) are redirections, not job separators
+            if buf.strip():
+                result.append((buf.strip(), True))
             buf = ''
         else:
             buf += ch
+        i += 1
     if buf.strip():
-        result.append(buf.strip())
+        result.append((buf.strip(), False))
     return result
 
 
-def main() -> int:
+# --- Persistent history -------------------------------------------------------
+# The history file is append-only, one entry per line. A trigram index lives
+# next to it in two files: <hist>.idx (header + open-addressing table mapping
+# trigram -> posting count and newest block) and <hist>.blk (fixed-size blocks
+# of 32-bit entry offsets, chained newest -> oldest). Appends only touch the history
+# file; the index catches up lazily, under the same lock, on the next search.
+
+HISTFILE = os.environ.get('PYSH_HISTFILE') or os.path.join(HOME, '.pysh_history')
+HISTORY: Optional['History'] = None
+
+_IDX_MAGIC = b'PYSHIDX1'
+_BLK_MAGIC = b'PYSHBLK1'
+_IDX_VERSION = 1
+_IDX_HEADER = struct.Struct('<8sIIIIQ')  # magic, version, capacity, used, reserved, indexed_bytes
+_IDX_SLOT = struct.Struct('<IIQ')        # trigram key, posting count, newest block
+_BLK_HEADER = struct.Struct('<QII')      # previous block, used slots, reserved
+BLOCK_SLOTS = 124
+BLOCK_SIZE = _BLK_HEADER.size + 4 * BLOCK_SLOTS  # 512 bytes
+_MAX_OFFSET = 1 << 32  # entries past 4 GiB of history are not indexed
+_CATCHUP_BATCH = 50000  # entries indexed per in-memory batch
+
+
+# Windows locks are mandatory byte-range locks, so lock one byte far past
+# EOF: shells exclude each other without blocking lock-free readers
+_WIN_LOCK_OFFSET = 1 << 62
+
+
+@contextmanager
+def _file_lock(f: IO[bytes]) -> Iterator[None]:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            f.flush()
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return
+    pos = f.tell()
+    f.seek(_WIN_LOCK_OFFSET)
+    while True:
+        try:
+            # LK_LOCK itself retries for ~10s; keep waiting like flock does
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            break
+        except OSError as e:
+            if e.errno != errno.EDEADLOCK:
+                raise
+    f.seek(pos)
+    try:
+        yield
+    finally:
+        f.flush()
+        f.seek(_WIN_LOCK_OFFSET)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.seek(pos)
+
+
+def _trigrams(data: bytes) -> set:
+    # Keys carry bit 24 so that 0 can mark an empty table slot
+    return {int.from_bytes(data[i:i + 3], 'big') | 0x1000000 for i in range(len(data) - 2)}
+
+
+class HistoryIndex:
+    """On-disk trigram index over a history file; callers hold the history lock."""
+
+    def __init__(self, hist_path: str):
+        self.hist_path = hist_path
+        self.idx_path = hist_path + '.idx'
+        self.blk_path = hist_path + '.blk'
+        self.idx_f: Optional[IO[bytes]] = None
+        self.blk_f: Optional[IO[bytes]] = None
+        self.table: Optional[mmap.mmap] = None
+        self.capacity = 0
+        self.used = 0
+        self.indexed_bytes = 0
+
+    def open(self) -> 'HistoryIndex':
+        try:
+            self._load()
+        except (OSError, ValueError, struct.error):
+            self.close()
+            self._create()
+        return self
+
+    def close(self) -> None:
+        for obj in (self.table, self.idx_f, self.blk_f):
+            if obj is not None:
+                obj.close()
+        self.table = self.idx_f = self.blk_f = None
+
+    def _load(self) -> None:
+        import mmap
+        self.idx_f = open(self.idx_path, 'r+b')
+        self.blk_f = open(self.blk_path, 'r+b')
+        self.table = mmap.mmap(self.idx_f.fileno(), 0)
+        magic, version, cap, used, _r, indexed = _IDX_HEADER.unpack_from(self.table, 0)
+        if (magic != _IDX_MAGIC or version != _IDX_VERSION or cap & (cap - 1)
+                or len(self.table) != _IDX_HEADER.size + cap * _IDX_SLOT.size
+                or self.blk_f.read(8) != _BLK_MAGIC):
+            raise ValueError('stale history index')
+        self.capacity, self.used, self.indexed_bytes = cap, used, indexed
+
+    def _create(self, capacity: int = 1 << 16) -> None:
+        with open(self.blk_path, 'wb') as f:
+            f.write(_BLK_MAGIC.ljust(16, b'\0'))
+        self._write_table(capacity, [])
+        self.indexed_bytes = 0
+        self._save_header()
+        self.blk_f = open(self.blk_path, 'r+b')
+
+    def _write_table(self, capacity: int, slots: List[Tuple[int, int, int]]) -> None:
+        import mmap
+        if self.table is not None:
+            self.table.close()
+        if self.idx_f is None:
+            self.idx_f = open(self.idx_path, 'w+b')
+        self.idx_f.truncate(0)
+        self.idx_f.truncate(_IDX_HEADER.size + capacity * _IDX_SLOT.size)
+        self.table = mmap.mmap(self.idx_f.fileno(), 0)
+        self.capacity, self.used = capacity, 0
+        for key, count, last in slots:
+            i = self._probe(key)
+            _IDX_SLOT.pack_into(self.table, _IDX_HEADER.size + i * _IDX_SLOT.size, key, count, last)
+            self.used += 1
+
+    def _save_header(self) -> None:
+        assert self.table is not None
+        _IDX_HEADER.pack_into(self.table, 0, _IDX_MAGIC, _IDX_VERSION,
+                              self.capacity, self.used, 0, self.indexed_bytes)
+
+    def _probe(self, key: int) -> int:
+        # Linear probing; returns the slot holding key or the empty slot for it
+        assert self.table is not None
+        mask = self.capacity - 1
+        i = (key * 2654435761) & mask
+        while True:
+            k = _IDX_SLOT.unpack_from(self.table, _IDX_HEADER.size + i * _IDX_SLOT.size)[0]
+            if k == key or k == 0:
+                return i
+            i = (i + 1) & mask
+
+    def _slot(self, key: int) -> Tuple[int, int]:
+        assert self.table is not None
+        k, count, last = _IDX_SLOT.unpack_from(
+            self.table, _IDX_HEADER.size + self._probe(key) * _IDX_SLOT.size)
+        return (count, last) if k == key else (0, 0)
+
+    def _grow(self) -> None:
+        assert self.table is not None
+        slots = []
+        for i in range(self.capacity):
+            slot = _IDX_SLOT.unpack_from(self.table, _IDX_HEADER.size + i * _IDX_SLOT.size)
+            if slot[0]:
+                slots.append(slot)
+        self._write_table(self.capacity * 2, slots)
+
+    def _add_postings(self, key: int, offsets: List[int]) -> None:
+        assert self.table is not None and self.blk_f is not None
+        if (self.used + 1) * 10 > self.capacity * 7:
+            self._grow()
+        i = self._probe(key)
+        pos = _IDX_HEADER.size + i * _IDX_SLOT.size
+        k, count, last = _IDX_SLOT.unpack_from(self.table, pos)
+        if k == 0:
+            self.used += 1
+        done = 0
+        if last:
+            # Fill the newest block in place before chaining a new one
+            self.blk_f.seek(last)
+            prev, filled, _r = _BLK_HEADER.unpack(self.blk_f.read(_BLK_HEADER.size))
+            take = offsets[:BLOCK_SLOTS - filled]
+            if take:
+                self.blk_f.seek(last + _BLK_HEADER.size + 4 * filled)
+                self.blk_f.write(struct.pack(f'<{len(take)}I', *take))
+                self.blk_f.seek(last)
+                self.blk_f.write(_BLK_HEADER.pack(prev, filled + len(take), 0))
+                done = len(take)
+        self.blk_f.seek(0, os.SEEK_END)
+        while done < len(offsets):
+            chunk = offsets[done:done + BLOCK_SLOTS]
+            new = self.blk_f.tell()
+            self.blk_f.write(_BLK_HEADER.pack(last, len(chunk), 0))
+            self.blk_f.write(struct.pack(f'<{len(chunk)}I', *chunk).ljust(4 * BLOCK_SLOTS, b'\0'))
+            last = new
+            done += len(chunk)
+        _IDX_SLOT.pack_into(self.table, pos, key, count + len(offsets), last)
+
+    def catch_up(self, hist: mmap.mmap) -> None:
+        """Index entries appended since the last call (or rebuild if truncated)."""
+        size = len(hist)
+        if self.indexed_bytes > size:
+            self.close()
+            self._create()
+        start = self.indexed_bytes
+        size = min(size, _MAX_OFFSET)
+        while start < size:
+            postings: Dict[int, List[int]] = {}
+            n = 0
+            while start < size and n < _CATCHUP_BATCH:
+                end = hist.find(b'\n', start)
+                if end < 0:
+                    break  # partial line still being written by another shell
+                for key in _trigrams(hist[start:end].lower()):
+                    postings.setdefault(key, []).append(start)
+                start = end + 1
+                n += 1
+            for key, offsets in postings.items():
+                self._add_postings(key, offsets)
+            self.indexed_bytes = start
+            self._save_header()
+            if n < _CATCHUP_BATCH:
+                break
+        assert self.blk_f is not None
+        self.blk_f.flush()
+
+    def _postings(self, last: int) -> Iterator[int]:
+        # Newest first
+        assert self.blk_f is not None
+        while last:
+            self.blk_f.seek(last)
+            block = self.blk_f.read(BLOCK_SIZE)
+            prev, filled, _r = _BLK_HEADER.unpack_from(block, 0)
+            offsets = struct.unpack_from(f'<{filled}I', block, _BLK_HEADER.size)
+            yield from reversed(offsets)
+            last = prev
+
+    def search(self, hist: mmap.mmap, query: str, limit: int = 20,
+               max_candidates: int = 5000) -> List[str]:
+        """Fuzzy lookup: entries sharing at least half the query's trigrams, best first.
+
+        By pigeonhole such an entry must appear in one of the k rarest posting
+        chains (k = trigrams - needed + 1); those chains are merged newest to
+        oldest and capped at max_candidates, so cost does not grow with
+        history size.
+        """
+        import heapq
+        q = query.lower().encode('utf-8')
+        qkeys = _trigrams(q)
+        qgrams = {q[i:i + 3] for i in range(len(q) - 2)}
+        present = sorted(slot for slot in map(self._slot, qkeys) if slot[0])
+        need = max(1, -(-len(qgrams) // 2))  # ceil(50%) of query trigrams
+        k = len(present) - need + 1
+        if k <= 0:
+            return []
+        chains = heapq.merge(*(self._postings(last) for _count, last in present[:k]), reverse=True)
+        seen: set = set()
+        scored: List[Tuple[int, int, int, str]] = []
+        exact = 0
+        prev_off = -1
+        for n, off in enumerate(chains):
+            if n >= max_candidates or exact >= limit:
+                break
+            if off == prev_off:
+                continue
+            prev_off = off
+            end = hist.find(b'\n', off)
+            raw = hist[off:end if end >= 0 else len(hist)]
+            if raw in seen:
+                continue
+            seen.add(raw)
+            low = raw.lower()
+            is_exact = q in low
+            shared = len(qgrams) if is_exact else sum(g in low for g in qgrams)
+            if shared < need:
+                continue
+            exact += is_exact
+            scored.append((-is_exact, -shared, -off, raw.decode('utf-8', errors='replace')))
+        scored.sort()
+        return [entry for *_rank, entry in scored[:limit]]
+
+
+class History:
+    """Append-only command history shared by concurrent shells."""
+
+    def __init__(self, path: str = HISTFILE):
+        self.path = path
+
+    def append(self, line: str) -> None:
+        entry = line.replace('\n', ' ').strip()
+        if not entry:
+            return
+        try:
+            with open(self.path, 'ab') as f, _file_lock(f):
+                f.write(entry.encode('utf-8', errors='replace') + b'\n')
+        except OSError:
+            pass
+
+    def recent(self, n: int) -> List[str]:
+        """Last n entries, oldest first; reads only the tail of the file."""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                pos = f.tell()
+                chunk = b''
+                while pos > 0 and chunk.count(b'\n') <= n:
+                    step = min(pos, 65536)
+                    pos -= step
+                    f.seek(pos)
+                    chunk = f.read(step) + chunk
+        except OSError:
+            return []
+        lines = chunk.split(b'\n')
+        if pos > 0:
+            lines = lines[1:]  # first line may be partial
+        return [l.decode('utf-8', errors='replace') for l in lines if l][-n:]
+
+    def search(self, query: str, limit: int = 20) -> List[str]:
+        if len(query.encode('utf-8')) < 3:
+            # Too short for trigrams: plain substring scan over recent entries
+            q = query.lower()
+            hits: List[str] = []
+            for entry in reversed(self.recent(10000)):
+                if q in entry.lower() and entry not in hits:
+                    hits.append(entry)
+                    if len(hits) >= limit:
+                        break
+            return hits
+        import mmap
+        try:
+            with open(self.path, 'a+b') as f, _file_lock(f):
+                if os.fstat(f.fileno()).st_size == 0:
+                    return []
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as hist:
+                    index = HistoryIndex(self.path).open()
+                    try:
+                        index.catch_up(hist)
+                        return index.search(hist, query, limit)
+                    finally:
+                        index.close()
+        except OSError as e:
+            print(f"history: {e}", file=sys.stderr)
+            return []
+
+
+def builtin_history(argv: List[str], out: IO[str], err: IO[str]) -> int:
+    if HISTORY is None:
+        print("history: not available in this mode", file=err)
+        return 1
+    if len(argv) > 1 and argv[1] == '-s':
+        if len(argv) < 3:
+            print("usage: history -s query", file=err)
+            return 2
+        for entry in HISTORY.search(' '.join(argv[2:])):
+            print(entry, file=out)
+        return 0
+    n = int(argv[1]) if len(argv) > 1 and argv[1].isdigit() else 20
+    for entry in HISTORY.recent(n):
+        print(entry, file=out)
+    return 0
+
+
+def setup_readline(history: History, preload: int = 1000) -> None:
+    try:
+        import readline
+    except ImportError:
+        return
+    for entry in history.recent(preload):
+        readline.add_history(entry)
+
+
+def builtin_profile(argv: List[str], out: IO[str], err: IO[str]) -> int:
+    sub = argv[1] if len(argv) > 1 else 'summary'
+    if sub == 'on':
+        PROFILER.enabled = True
+    elif sub == 'off':
+        PROFILER.enabled = False
+    elif sub == 'reset':
+        PROFILER.reset()
+    elif sub == 'summary':
+        PROFILER.summary(out)
+    elif sub == 'trace':
+        try:
+            path = PROFILER.write_trace(argv[2] if len(argv) > 2 else None)
+        except OSError as e:
+            print(f"profile: {e}", file=err)
+            return 1
+        if path is None:
+            print("usage: profile trace FILE (or set PYSH_TRACE)", file=err)
+            return 2
+        print(f"trace written to {path}", file=err)
+    else:
+        print("usage: profile [on|off|reset|summary|trace [FILE]]", file=err)
+        return 2
+    return 0
+
+
+def _write_trace_at_exit() -> None:
+    if PROFILER.trace_path and PROFILER.events:
+        try:
+            PROFILER.write_trace()
+        except OSError as e:
+            print(f"profile: {e}", file=sys.stderr)
+
+
+atexit.register(_write_trace_at_exit)
+
+
+# A lexed command: (label, background, stages)
+ParsedCommand = Tuple[str, bool, List[List[str]]]
+
+
+def parse_line(line: str) -> List[ParsedCommand]:
+    parsed: List[ParsedCommand] = []
+    for cmd_str, background in split_commands(line):
+        with PROFILER.span('parse_pipeline'):
+            stages = lex_pipeline(cmd_str)
+        parsed.append((cmd_str, background, stages))
+    return parsed
+
+
+def parse_script(text: str, name: str = '<script>') -> List[ParsedCommand]:
+    parsed: List[ParsedCommand] = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            parsed.extend(parse_line(line))
+        except ValueError as e:
+            raise ValueError(f"{name}:{lineno}: {e}") from None
+    return parsed
+
+
+def load_script(path: str, use_cache: bool = True) -> List[ParsedCommand]:
+    """Parse a script, reusing the sidecar cache when hash and parser version match."""
+    import hashlib
+    import json
+    with open(path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    cache_path = path + SCRIPT_CACHE_SUFFIX
+    if use_cache:
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('parser') == PARSER_VERSION and cached.get('sha256') == digest:
+                return [(label, bg, stages) for label, bg, stages in cached['commands']]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    parsed = parse_script(raw.decode('utf-8', errors='replace'), path)
+    if use_cache:
+        tmp = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'parser': PARSER_VERSION, 'sha256': digest, 'commands': parsed}, f)
+            os.replace(tmp, cache_path)
+        except OSError:
+            # read-only location: run uncached
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+    return parsed
+
+
+def run_parsed(commands: List[ParsedCommand], env: Dict[str, str]) -> int:
+    code = 0
+    for label, background, stages in commands:
+        timed = bool(stages) and stages[0][:1] == ['time']
+        if timed:
+            stages = [stages[0][1:]] + stages[1:]
+            if not background:
+                code = run_timed(label, stages, env)
+                continue
+        try:
+            with PROFILER.span('command', cmd=label):
+                pipeline = build_pipeline([s for s in stages if s], env)
+                code = launch_pipeline(pipeline, env, background=background, label=label,
+                                       timed=timed)
+            # If desired, could stop on non-zero; keep going for now
+        except Exception as e:
+            print(f"error: {e}", file=sys.stderr)
+            code = 1
+    return code
+
+
+def _print_times(real: float, user: float, system: float, prefix: str = '') -> None:
+    for name, secs in (('real', real), ('user', user), ('sys', system)):
+        print(f"{prefix}{name}\t{int(secs // 60)}m{secs % 60:.3f}s", file=sys.stderr)
+
+
+def run_timed(label: str, stages: List[List[str]], env: Dict[str, str]) -> int:
+    """`time pipeline`: real/user/sys like bash, plus the per-stage breakdown."""
+    global PROFILER
+    outer = PROFILER
+    PROFILER = Profiler(enabled=True)
+    t0 = os.times()
+    start = time.perf_counter()
+    code = 0
+    try:
+        pipeline = build_pipeline([s for s in stages if s], env)
+        code = launch_pipeline(pipeline, env, label=label)
+    except Exception as e:
+        print(f"error: {e}", file=sys.stderr)
+        code = 1
+    finally:
+        real = time.perf_counter() - start
+        t1 = os.times()
+        timed, PROFILER = PROFILER, outer
+    user = (t1.user - t0.user) + (t1.children_user - t0.children_user)
+    system = (t1.system - t0.system) + (t1.children_system - t0.children_system)
+    _print_times(real, user, system)
+    timed.summary(sys.stderr)
+    if outer.enabled:
+        outer.merge(timed)
+    return code
+
+
+def set_positional(name: str, args: List[str]) -> None:
+    POSITIONAL.clear()
+    POSITIONAL['0'] = name
+    for i, a in enumerate(args, 1):
+        POSITIONAL[str(i)] = a
+    POSITIONAL['#'] = str(len(args))
+    POSITIONAL['@'] = POSITIONAL['*'] = ' '.join(args)
+
+
+USAGE = "usage: pyshell.py [--no-cache] [-c command [name [args...]] | script.pysh [args...]]"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = sys.argv[1:] if argv is None else argv
     env = dict(os.environ)
     env.setdefault('TERM', 'xterm-256color')
     env.setdefault('HOME', HOME)
+    use_cache = True
+    while args and args[0].startswith('-'):
+        opt = args.pop(0)
+        if opt == '--no-cache':
+            use_cache = False
+        elif opt == '-c':
+            if not args:
+                print(USAGE, file=sys.stderr)
+                return 2
+            command = args.pop(0)
+            set_positional(args[0] if args else 'pyshell', args[1:])
+            try:
+                parsed = parse_line(command)
+            except ValueError as e:
+                print(f"pyshell: {e}", file=sys.stderr)
+                return 2
+            return run_parsed(parsed, env)
+        elif opt in ('-h', '--help'):
+            print(USAGE)
+            return 0
+        elif opt == '--':
+            break
+        else:
+            print(USAGE, file=sys.stderr)
+            return 2
+    if args:
+        script = args[0]
+        set_positional(script, args[1:])
+        try:
+            parsed = load_script(script, use_cache=use_cache)
+        except (OSError, ValueError) as e:
+            print(f"pyshell: {e}", file=sys.stderr)
+            return 2
+        return run_parsed(parsed, env)
+    return interactive(env)
+
+
+def interactive(env: Dict[str, str]) -> int:
+    global HISTORY
+    HISTORY = History()
+    if sys.stdin.isatty():
+        # input() only uses readline on a terminal; piped input skips the import
+        setup_readline(HISTORY)
     while True:
+        reap_jobs()
         try:
             cwd = os.getcwd()
             prompt = f"{cwd}$ "
@@ -285,13 +1809,21 @@ def main() -> int:
             break
         if not line.strip():
             continue
-        for cmd_str in split_commands(line):
-            try:
-                pipeline = parse_pipeline(cmd_str, env)
-                code = launch_pipeline(pipeline, env)
-                # If desired, could stop on non-zero; keep going for now
-            except Exception as e:
-                print(f"error: {e}", file=sys.stderr)
+        if line.startswith('!?'):
+            # !?text re-runs the best fuzzy history match
+            hits = HISTORY.search(line[2:].strip(), limit=1)
+            if not hits:
+                print(f"{line}: event not found", file=sys.stderr)
+                continue
+            line = hits[0]
+            print(line)
+        try:
+            parsed = parse_line(line)
+        except ValueError as e:
+            print(f"error: {e}", file=sys.stderr)
+            continue
+        run_parsed(parsed, env)
+        HISTORY.append(line)
     return 0
 
 